@@ -2,8 +2,11 @@
 import os
 import sys
 import time
-import base64
-import requests
+import queue
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,15 +15,22 @@ from wanikani_assistant.clipboard_listener import ClipboardListener
 from wanikani_assistant.ai_agent import AIAgent
 from wanikani_assistant.image_fetcher import ImageFetcher
 from wanikani_assistant.audio_generator import AudioGenerator
+from wanikani_assistant.anki_connector import SESSION, b64encode_file
 
 # Config - change if you want
 DECK_NAME = os.getenv("WK_DECK_NAME", "Test Script Wk deck")
 SVENSKA_MODEL_NAME = os.getenv("SVENSKA_MODEL_NAME", "Basic+")
-ANKI_CONNECT_URL = os.getenv("ANKI_CONNECT_URL", "http://localhost:8765")
+ANKI_CONNECT_URL = os.getenv("ANKI_CONNECT_URL", "http://127.0.0.1:8765")
 MEDIA_FOLDER = "media"
+SEEN_NOTES_DB = os.path.join(MEDIA_FOLDER, "seen_notes.db")
+# The batched multi request carries base64 media, so give it more time than single calls
+ANKI_MULTI_TIMEOUT = 120
 
 os.makedirs(MEDIA_FOLDER, exist_ok=True)
 
+# Background workers for speculative TTS / image prefetch while the user types
+_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
 
 def safe_input(prompt=""):
     try:
@@ -29,36 +39,43 @@ def safe_input(prompt=""):
         return ""
 
 
+def _wrap(x):
+    return f'<div style="background:black; color:orange;">{x or ""}</div>'
+
+
 # ---------------------
 # Anki helpers
 # ---------------------
-def invoke_anki(action, params=None, anki_url=ANKI_CONNECT_URL):
+def _post_anki(action, params=None, anki_url=ANKI_CONNECT_URL, timeout=20):
+    """Send one AnkiConnect request; transport errors are raised, not swallowed."""
     payload = {"action": action, "version": 6}
     if params:
         payload["params"] = params
+    r = SESSION.post(anki_url, json=payload, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+
+def invoke_anki(action, params=None, anki_url=ANKI_CONNECT_URL):
     try:
-        r = requests.post(anki_url, json=payload, timeout=20)
-        r.raise_for_status()
-        return r.json()
+        return _post_anki(action, params, anki_url)
     except Exception as e:
         print("[AnkiConnect error]", e)
         return {"error": str(e), "result": None}
 
 
-def store_media_file(filename, filepath):
+def store_media_file_action(filename, filepath):
+    """Build a storeMediaFile action (without sending it). None if the file is missing."""
     if not os.path.exists(filepath):
         print(f"[store_media_file] file not found: {filepath}")
-        return False
-    with open(filepath, "rb") as f:
-        data_b64 = base64.b64encode(f.read()).decode("utf-8")
-    resp = invoke_anki("storeMediaFile", {"filename": filename, "data": data_b64})
-    if resp.get("error"):
-        print("[store_media_file] Anki error:", resp["error"])
-        return False
-    return True
+        return None
+    data_b64 = b64encode_file(filepath)
+    return {"action": "storeMediaFile", "version": 6,
+            "params": {"filename": filename, "data": data_b64}}
 
 
-def add_note_to_anki(deck_name, model_name, fields: dict, tags=None):
+def add_note_action(deck_name, model_name, fields: dict, tags=None):
+    """Build an addNote action (without sending it)."""
     note = {
         "deckName": deck_name,
         "modelName": model_name,
@@ -66,19 +83,166 @@ def add_note_to_anki(deck_name, model_name, fields: dict, tags=None):
         "options": {"allowDuplicate": True},
         "tags": tags or []
     }
-    resp = invoke_anki("addNote", {"note": note})
+    return {"action": "addNote", "version": 6, "params": {"note": note}}
+
+
+def store_media_file(filename, filepath):
+    action = store_media_file_action(filename, filepath)
+    if action is None:
+        return False
+    resp = invoke_anki(action["action"], action["params"])
+    if resp.get("error"):
+        print("[store_media_file] Anki error:", resp["error"])
+        return False
+    return True
+
+
+def add_note_to_anki(deck_name, model_name, fields: dict, tags=None):
+    action = add_note_action(deck_name, model_name, fields, tags)
+    resp = invoke_anki(action["action"], action["params"])
     if resp.get("error"):
         print("[add_note_to_anki] error:", resp["error"])
         return False, resp
     return True, resp
 
 
+def add_note_with_media(deck_name, model_name, fields: dict, media, tags=None):
+    """
+    Upload media and add the note in a single AnkiConnect `multi` request.
+    media: list of (field_name, field_value, filename, filepath)
+    Falls back to sequential calls only if AnkiConnect rejects `multi` itself; a transport
+    error (e.g. a read timeout) is not retried, since Anki may already have added the note.
+    """
+    media_actions = []
+    for field_name, field_value, filename, filepath in media:
+        action = store_media_file_action(filename, filepath)
+        if action is not None:
+            media_actions.append((field_name, filename, filepath, action))
+            fields[field_name] = field_value
+
+    actions = [a for _, _, _, a in media_actions]
+    actions.append(add_note_action(deck_name, model_name, fields, tags))
+
+    try:
+        resp = _post_anki("multi", {"actions": actions}, timeout=ANKI_MULTI_TIMEOUT)
+    except Exception as e:
+        print("[AnkiConnect error]", e)
+        return False, {"error": str(e), "result": None}
+
+    if resp.get("error"):
+        print("[add_note_with_media] multi failed, falling back to sequential calls:", resp["error"])
+        for field_name, filename, filepath, _ in media_actions:
+            if not store_media_file(filename, filepath):
+                fields[field_name] = ""
+        return add_note_to_anki(deck_name, model_name, fields, tags)
+
+    results = resp.get("result")
+    if not isinstance(results, list) or len(results) != len(actions):
+        print("[add_note_with_media] unexpected multi response:", resp)
+        return False, resp
+
+    # results are positional: media uploads first, addNote last
+    failed_fields = {}
+    for (field_name, filename, _, _), res in zip(media_actions, results):
+        if res.get("error"):
+            print(f"[store_media_file] Anki error ({filename}):", res["error"])
+            failed_fields[field_name] = ""
+
+    note_resp = results[-1]
+    if note_resp.get("error"):
+        print("[add_note_to_anki] error:", note_resp["error"])
+        return False, note_resp
+
+    # same outcome as the sequential path: don't leave fields pointing at missing media
+    if failed_fields:
+        fields.update(failed_fields)
+        resp = invoke_anki("updateNoteFields", {"note": {"id": note_resp.get("result"), "fields": failed_fields}})
+        if resp.get("error"):
+            print("[updateNoteFields] error:", resp["error"])
+    return True, note_resp
+
+
+# ---------------------
+# Duplicate detection
+# ---------------------
+def open_seen_notes(path=SEEN_NOTES_DB):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS seen_notes (hash TEXT PRIMARY KEY)")
+    return conn
+
+
+def note_hash(jp_sentence, target_word, english_word):
+    return hashlib.sha1(f"{jp_sentence}|{target_word or ''}|{english_word or ''}".encode("utf-8")).hexdigest()
+
+
+def is_seen_note(conn, h):
+    return conn.execute("SELECT 1 FROM seen_notes WHERE hash = ?", (h,)).fetchone() is not None
+
+
+def mark_seen_note(conn, h):
+    conn.execute("INSERT OR IGNORE INTO seen_notes (hash) VALUES (?)", (h,))
+    conn.commit()
+
+
+# Sentences shorter than this match too many unrelated notes to be worth searching
+MIN_DUPLICATE_SEARCH_CHARS = 4
+
+_REGEX_SPECIAL = set("\\.+*?()|[]{}^$")
+
+
+def _anki_search_escape(text):
+    for ch in ("\\", '"', "*", "_"):
+        text = text.replace(ch, "\\" + ch)
+    return text
+
+
+def _sentence_regex(sentence):
+    # allow HTML tags between any two characters, so the sentence still matches after
+    # the target word has been wrapped in highlight markup (wherever that word is)
+    chars = ["\\" + c if c in _REGEX_SPECIAL else c for c in sentence]
+    return "(?:<[^>]*>)*".join(chars)
+
+
+def find_existing_notes(jp_sentence):
+    """Return note ids in DECK_NAME whose Examples field already contains this whole sentence."""
+    if len(jp_sentence) < MIN_DUPLICATE_SEARCH_CHARS:
+        return []
+    # re: input is passed to the regex engine raw; only quotes need escaping
+    pattern = _sentence_regex(jp_sentence).replace('"', '\\"')
+    query = f'deck:"{_anki_search_escape(DECK_NAME)}" "Examples:re:{pattern}"'
+    resp = invoke_anki("findNotes", {"query": query})
+    if resp.get("error"):
+        return []
+    return resp.get("result") or []
+
+
+# ---------------------
+# Clipboard thread
+# ---------------------
+def start_clipboard_thread(clip_queue):
+    """Run the clipboard listener on a daemon thread so copies made mid-conversation are queued, not lost."""
+    def run():
+        # created on this thread: the Win32 backend's message window belongs to its creating thread
+        try:
+            for text in ClipboardListener().listen():
+                clip_queue.put(text)
+            raise RuntimeError("clipboard listener stopped")
+        except Exception as e:
+            # hand the failure to the main loop instead of dying silently
+            clip_queue.put(e)
+
+    thread = threading.Thread(target=run, name="clipboard-listener", daemon=True)
+    thread.start()
+    return thread
+
+
 # ---------------------
 # Main app
 # ---------------------
 def main():
     print("Starting WaniKani Assistant (Svenska flow). Ctrl+C to quit.\n")
-    listener = ClipboardListener()
+    clip_queue = queue.Queue(maxsize=4)
+    start_clipboard_thread(clip_queue)
     ai = AIAgent()
 
     try:
@@ -88,11 +252,19 @@ def main():
         img_fetcher = None
 
     tts = AudioGenerator()
+    seen_notes = open_seen_notes()
 
     print("Listening for copied Japanese sentences...")
 
     try:
-        for clipboard_text in listener.listen():
+        while True:
+            # timeout keeps Ctrl+C responsive (a bare Queue.get() blocks it on Windows)
+            try:
+                clipboard_text = clip_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if isinstance(clipboard_text, Exception):
+                raise clipboard_text
 
             # -------------------------
             # Parse clipboard
@@ -115,6 +287,23 @@ def main():
                 print("No card created. Listening...\n")
                 continue
 
+            # -------------------------
+            # DUPLICATE CHECK (sentence-level, before any paid TTS / image search)
+            # -------------------------
+            confirmed_duplicate = False
+            if find_existing_notes(jp_sentence):
+                print(f"A note with this sentence already exists in '{DECK_NAME}'.")
+                if safe_input("Create it anyway? (y/N): ").strip().lower() != "y":
+                    print("No card created. Listening...\n")
+                    continue
+                confirmed_duplicate = True
+
+            # The user has committed to a card (/anki or /image): start TTS now so it overlaps
+            # with the metadata prompts. Not done earlier because a running future can't be
+            # cancelled, so /skip or a declined duplicate would still be billed.
+            audio_future = _EXECUTOR.submit(tts.generate_audio, jp_sentence)
+            fut_img = None
+
             # -------------------------
             # IMAGE PROMPT flow
             # -------------------------
@@ -122,6 +311,9 @@ def main():
                 image_idea = safe_input("Enter image idea (or /skip): ").strip()
                 if image_idea.lower() == "/skip" or image_idea == "":
                     image_idea = None
+                if image_idea and img_fetcher:
+                    print("Searching for image for:", image_idea)
+                    fut_img = _EXECUTOR.submit(img_fetcher.search_and_download, image_idea, jp_sentence)
 
                 target_word = None
                 english_word = ""
@@ -141,6 +333,9 @@ def main():
                 image_idea = safe_input("3) Image idea (or /skip): ").strip()
                 if image_idea.lower() == "/skip" or image_idea == "":
                     image_idea = None
+                if image_idea and img_fetcher:
+                    print("Searching for image for:", image_idea)
+                    fut_img = _EXECUTOR.submit(img_fetcher.search_and_download, image_idea, jp_sentence)
 
                 if eng_sentence_auto:
                     print(f"Auto-detected English translation: {eng_sentence_auto}")
@@ -149,13 +344,22 @@ def main():
                     eng_translation = safe_input("4) English translation of the entire sentence: ").strip()
 
             # -------------------------
-            # IMAGE FETCH
+            # SEEN-CARD CHECK (local, needs the target word; before uploads)
+            # -------------------------
+            h = note_hash(jp_sentence, target_word, english_word)
+            if is_seen_note(seen_notes, h) and not confirmed_duplicate:
+                print("This card was already created in a previous run.")
+                if safe_input("Create it anyway? (y/N): ").strip().lower() != "y":
+                    print("No card created. Listening...\n")
+                    continue
+
+            # -------------------------
+            # IMAGE FETCH + AUDIO GENERATION (started in the background above)
             # -------------------------
             image_filename = None
-            if image_idea and img_fetcher:
-                print("Searching for image for:", image_idea)
+            if fut_img:
                 try:
-                    url, image_filename = img_fetcher.search_and_download(image_idea, jp_sentence)
+                    url, image_filename = fut_img.result()
                 except Exception as e:
                     print("Image fetch error:", e)
                     image_filename = None
@@ -166,13 +370,10 @@ def main():
             elif image_idea and not img_fetcher:
                 print("Image idea provided but ImageFetcher unavailable.")
 
-            # -------------------------
-            # AUDIO GENERATION
-            # -------------------------
             print("Generating sentence audio...")
             audio_filename = None
             try:
-                audio_filename = tts.generate_audio(jp_sentence)
+                audio_filename = audio_future.result()
             except Exception as e:
                 print("TTS failed:", e)
                 audio_filename = None
@@ -180,10 +381,12 @@ def main():
             # -------------------------
             # BUILD CARD FIELDS
             # -------------------------
-            if target_word and target_word in jp_sentence:
-                highlighted_example = jp_sentence.replace(
-                    target_word,
-                    f'<b><span style="color:red;">{target_word}</span></b>'
+            pos = jp_sentence.find(target_word) if target_word else -1
+            if pos >= 0:
+                highlighted_example = (
+                    jp_sentence[:pos]
+                    + f'<b><span style="color:red;">{target_word}</span></b>'
+                    + jp_sentence[pos + len(target_word):]
                 )
             else:
                 highlighted_example = jp_sentence
@@ -193,47 +396,34 @@ def main():
                 if target_word else ""
             )
 
-            STYLE_WRAPPER_START = '<div style="background:black; color:orange;">'
-            STYLE_WRAPPER_END = '</div>'
-
             fields = {
-                "Front[ENG]": f"{STYLE_WRAPPER_START}{english_word}{STYLE_WRAPPER_END}",
+                "Front[ENG]": _wrap(english_word),
                 "Image": "",
-                "Back[SWE]": f"{STYLE_WRAPPER_START}{back_swe_value}{STYLE_WRAPPER_END}",
-                "Examples": f"{STYLE_WRAPPER_START}{highlighted_example}{STYLE_WRAPPER_END}",
+                "Back[SWE]": _wrap(back_swe_value),
+                "Examples": _wrap(highlighted_example),
                 "Audio": "",
-                "Example English": f"{STYLE_WRAPPER_START}{eng_translation}{STYLE_WRAPPER_END}",
+                "Example English": _wrap(eng_translation),
                 "Audio Example": "",
                 "Grammar": ""
             }
 
             # -------------------------
-            # MEDIA UPLOAD
+            # MEDIA UPLOAD + ADD TO ANKI (single `multi` request)
             # -------------------------
+            media = []
             if image_filename:
-                image_path = os.path.join(MEDIA_FOLDER, image_filename)
-                ok = store_media_file(image_filename, image_path)
-                if ok:
-                    fields["Image"] = f'<img src="{image_filename}">'
-
+                media.append(("Image", f'<img src="{image_filename}">',
+                              image_filename, os.path.join(MEDIA_FOLDER, image_filename)))
             if audio_filename:
-                audio_path = os.path.join(MEDIA_FOLDER, audio_filename)
-                ok = store_media_file(audio_filename, audio_path)
-                if ok:
-                    fields["Audio Example"] = f"[sound:{audio_filename}]"
-
-            # Ensure no None values
-            for k in fields:
-                if fields[k] is None:
-                    fields[k] = ""
+                media.append(("Audio Example", f"[sound:{audio_filename}]",
+                              audio_filename, os.path.join(MEDIA_FOLDER, audio_filename)))
 
-            # -------------------------
-            # ADD TO ANKI
-            # -------------------------
             print("Adding card to Anki deck:", DECK_NAME)
-            ok, resp = add_note_to_anki(DECK_NAME, SVENSKA_MODEL_NAME, fields, tags=["wanikani", "auto"])
+            ok, resp = add_note_with_media(DECK_NAME, SVENSKA_MODEL_NAME, fields, media,
+                                           tags=["wanikani", "auto"])
             if ok:
                 print("✓ Card created! Note ID:", resp.get("result"))
+                mark_seen_note(seen_notes, h)
             else:
                 print("✗ Failed to create card:", resp)
 
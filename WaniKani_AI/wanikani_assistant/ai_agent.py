@@ -10,6 +10,11 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
 DEFAULT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o")
+# o-series (gpt-4o, o3-mini, etc.) usually disallow temperature or max_tokens — detect by leading 'o'
+_IS_O_MODEL = DEFAULT_MODEL.lower().startswith("o")
+
+# Max messages sent per request (leading system message + most recent turns)
+MAX_HISTORY_MESSAGES = 12
 
 # Base system instructions (kept minimal and strict)
 SYSTEM_PROMPT_BASE = (
@@ -28,8 +33,10 @@ class AIAgent:
     def __init__(self, model: Optional[str] = None):
         self.model = model or DEFAULT_MODEL
         self.enabled = client is not None
-        # o-series (gpt-4o, o3-mini, etc.) usually disallow temperature or max_tokens — detect by leading 'o'
-        self.is_o = bool(self.model and self.model.lower().startswith("o"))
+        self.is_o = _IS_O_MODEL if not model else model.lower().startswith("o")
+        # cached system message for the current (sentence, english) pair
+        self._system_key = None
+        self._system_message = None
 
     # =============================================================
     # Build a single strict system message embedding the user English (no separate context block)
@@ -53,13 +60,29 @@ class AIAgent:
             "5) End with the single question: 'Does this mapping match your intention?'\n"
         )
 
+    def _get_system_message(self, jp_sentence: str, eng_translation: str) -> str:
+        key = (jp_sentence, eng_translation)
+        if self._system_key != key:
+            self._system_key = key
+            self._system_message = self._build_system_message(jp_sentence, eng_translation)
+        return self._system_message
+
+    # =============================================================
+    # Keep the system message + most recent turns (bounds prompt tokens per request)
+    # =============================================================
+    def _trim_history(self, history):
+        if len(history) <= MAX_HISTORY_MESSAGES:
+            return history
+        head = history[:1] if history[0].get("role") == "system" else []
+        return head + history[-(MAX_HISTORY_MESSAGES - len(head)):]
+
     # =============================================================
     # Prepare payload safely (o-series compatibility + low temperature for non-o models)
     # =============================================================
     def _prepare_payload(self, history):
         payload = {
             "model": self.model,
-            "messages": history,
+            "messages": self._trim_history(history),
         }
 
         # configure deterministic/low-temperature behaviour for non-o models
@@ -100,7 +123,7 @@ class AIAgent:
             (None, None) on skip/exit
         """
         # Build the strict system message that includes the exact user English
-        system_message = self._build_system_message(sentence, english)
+        system_message = self._get_system_message(sentence, english)
 
         invite = f"Let's discuss this sentence: 「{sentence}」. What would you like to explore first?"
 
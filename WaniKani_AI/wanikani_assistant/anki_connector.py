@@ -2,23 +2,37 @@
 import os
 import requests
 import base64
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 load_dotenv()
 
-ANKI_URL = os.getenv("ANKI_CONNECT_URL", "http://localhost:8765")
+ANKI_URL = os.getenv("ANKI_CONNECT_URL", "http://127.0.0.1:8765")
+
+# Keep-alive session so every AnkiConnect call reuses one socket
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
 
 def invoke(action: str, params: dict = None, timeout: int = 15):
     payload = {"action": action, "version": 6}
     if params:
         payload["params"] = params
     try:
-        r = requests.post(ANKI_URL, json=payload, timeout=timeout)
+        r = SESSION.post(ANKI_URL, json=payload, timeout=timeout)
         r.raise_for_status()
         return r.json()
     except Exception as e:
         return {"error": str(e), "result": None}
 
+def b64encode_file(filepath, chunk_size=49152):
+    # chunk_size is a multiple of 3, so per-chunk encodings concatenate cleanly
+    # without holding the raw bytes and the encoded copy at the same time
+    buf = bytearray()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            buf += base64.b64encode(chunk)
+    return buf.decode("ascii")
+
 def store_media_file(filename: str, filepath: str):
     """
     Upload local file into Anki media using storeMediaFile.
@@ -27,8 +41,7 @@ def store_media_file(filename: str, filepath: str):
     """
     if not os.path.exists(filepath):
         return {"error": f"local file not found: {filepath}"}
-    with open(filepath, "rb") as f:
-        data_b64 = base64.b64encode(f.read()).decode("utf-8")
+    data_b64 = b64encode_file(filepath)
     return invoke("storeMediaFile", {"filename": filename, "data": data_b64})
 
 def add_note(note: dict):
@@ -1,6 +1,11 @@
 # audio_generator.py
 import os
-import random
+import atexit
+import shelve
+import hashlib
+import functools
+import threading
+import unicodedata
 from dotenv import load_dotenv
 from openai import OpenAI
 
@@ -12,6 +17,7 @@ os.makedirs(MEDIA_DIR, exist_ok=True)
 # OpenAI client
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+OPENAI_TTS_MODEL = os.getenv("OPENAI_TTS_MODEL", "gpt-4o-mini-tts")
 
 # gTTS fallback
 try:
@@ -20,14 +26,34 @@ except Exception:
     gTTS = None
 
 
+@functools.lru_cache(maxsize=1)
 def _parse_voices():
     raw = os.getenv("OPENAI_TTS_VOICES", "")
     voices = [v.strip() for v in raw.split(",") if v.strip()]
-    return voices or ["alloy", "verse", "lyric"]
+    return tuple(voices) or ("alloy", "verse", "lyric")
 
 
 DEFAULT_VOICES = _parse_voices()
 
+# Persistent map: "<model>|<normalized sentence>" -> audio filename (survives voice-list changes)
+_AUDIO_INDEX = shelve.open(os.path.join(MEDIA_DIR, "audio_cache.db"))
+_AUDIO_INDEX_LOCK = threading.Lock()
+atexit.register(_AUDIO_INDEX.close)
+
+
+def _normalize_sentence(sentence: str) -> str:
+    # NFKC folds half/full-width variants; trailing punctuation and spacing don't change the audio
+    normalized = unicodedata.normalize("NFKC", sentence)
+    normalized = " ".join(normalized.split())
+    return normalized.rstrip("。！？!? ")
+
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
 
 class AudioGenerator:
     """
@@ -35,48 +61,79 @@ class AudioGenerator:
     Uses OpenAI TTS if key available; falls back to gTTS.
     """
 
-    def __init__(self, voices=None):
+    def __init__(self, voices=None, model=None):
         self.voices = voices or DEFAULT_VOICES
+        self.model = model or OPENAI_TTS_MODEL
         self.openai_available = client is not None
 
-    def _safe_filename(self, sentence: str):
-        safe = str(abs(hash(sentence)))[:12]
-        return f"audio_{safe}.mp3"
+    def _pick_voice(self, sentence: str):
+        # deterministic per sentence so the same sentence always maps to the same cached file
+        h = hashlib.blake2b(sentence.encode("utf-8"), digest_size=8).hexdigest()
+        return self.voices[int(h, 16) % len(self.voices)]
+
+    def _safe_filename(self, sentence: str, voice: str):
+        # stable across processes (unlike hash()), so cached mp3s are reused between runs
+        key = f"{self.model}|{voice}|{sentence}".encode("utf-8")
+        h = hashlib.blake2b(key, digest_size=10).hexdigest()
+        return f"audio_{h}.mp3"
+
+    def _remember(self, index_key: str, filename: str):
+        with _AUDIO_INDEX_LOCK:
+            _AUDIO_INDEX[index_key] = filename
+            _AUDIO_INDEX.sync()
 
     def generate_audio(self, sentence: str) -> str | None:
-        filename = self._safe_filename(sentence)
+        normalized = _normalize_sentence(sentence)
+        index_key = f"{self.model}|{normalized}"
+
+        with _AUDIO_INDEX_LOCK:
+            known = _AUDIO_INDEX.get(index_key)
+        if known and os.path.exists(os.path.join(MEDIA_DIR, known)):
+            return known
+
+        voice = self._pick_voice(normalized)
+        filename = self._safe_filename(normalized, voice)
         fullpath = os.path.join(MEDIA_DIR, filename)
 
         # already exists
         if os.path.exists(fullpath):
+            self._remember(index_key, filename)
             return filename
 
+        # write to a temp name and move into place, so an interrupted write never leaves a
+        # truncated mp3 under the cached name
+        partpath = fullpath + ".part"
+
         # ---------- OpenAI TTS ----------
         if self.openai_available:
             try:
-                voice = random.choice(self.voices)
-
-                resp = client.audio.speech.create(
-                    model=os.getenv("OPENAI_TTS_MODEL", "gpt-4o-mini-tts"),
+                # stream chunks to disk as they arrive instead of buffering the whole response
+                with client.audio.speech.with_streaming_response.create(
+                    model=self.model,
                     voice=voice,
                     input=sentence,
-                )
-
-                # Correct: save using stream_to_file (2025 API)
-                resp.stream_to_file(fullpath)
+                    response_format="mp3",
+                ) as resp:
+                    resp.stream_to_file(partpath)
+                os.replace(partpath, fullpath)
 
+                self._remember(index_key, filename)
                 return filename
 
             except Exception as e:
+                _discard(partpath)
                 print("[AudioGenerator] OpenAI TTS failed, falling back. Err:", e)
 
         # ---------- gTTS fallback ----------
         if gTTS:
             try:
                 tts = gTTS(text=sentence, lang="ja")
-                tts.save(fullpath)
+                tts.save(partpath)
+                os.replace(partpath, fullpath)
+                self._remember(index_key, filename)
                 return filename
             except Exception as e:
+                _discard(partpath)
                 print("[AudioGenerator] gTTS failed:", e)
 
         return None
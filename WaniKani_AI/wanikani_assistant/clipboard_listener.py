@@ -1,31 +1,175 @@
 # clipboard_listener.py
+import sys
 import time
 import pyperclip
-from typing import Generator
+from typing import Generator, Optional
+
+
+def _paste():
+    try:
+        return pyperclip.paste()
+    except Exception:
+        return None
+
+
+class _PollingListener:
+    """Portable fallback: poll pyperclip.paste() on an interval."""
+
+    default_interval = 0.2
+
+    def __init__(self, poll_interval: Optional[float] = None):
+        self._poll_interval = poll_interval if poll_interval is not None else self.default_interval
+        self._last = _paste()
+
+    def _changed(self, current) -> bool:
+        if current and current != self._last:
+            self._last = current
+            return True
+        return False
+
+    def listen(self) -> Generator[str, None, None]:
+        while True:
+            current = _paste()
+            if self._changed(current):
+                yield current
+            time.sleep(self._poll_interval)
+
+
+class _MacListener(_PollingListener):
+    """
+    Polls NSPasteboard.changeCount (a cheap integer read) and only fetches
+    the clipboard text when it changes, instead of shelling out to pbpaste.
+    """
+
+    default_interval = 0.1
+
+    def __init__(self, poll_interval: Optional[float] = None):
+        from AppKit import NSPasteboard, NSPasteboardTypeString
+        self._pasteboard = NSPasteboard.generalPasteboard()
+        self._type = NSPasteboardTypeString
+        self._count = self._pasteboard.changeCount()
+        super().__init__(poll_interval)
+
+    def listen(self) -> Generator[str, None, None]:
+        while True:
+            count = self._pasteboard.changeCount()
+            if count != self._count:
+                self._count = count
+                current = self._pasteboard.stringForType_(self._type)
+                current = str(current) if current is not None else None
+                if self._changed(current):
+                    yield current
+            time.sleep(self._poll_interval)
+
+
+class _Win32Listener(_PollingListener):
+    """
+    Registers a hidden message-only window with AddClipboardFormatListener
+    and blocks on GetMessage until WM_CLIPBOARDUPDATE arrives.
+    """
+
+    WM_CLIPBOARDUPDATE = 0x031D
+
+    def __init__(self, poll_interval: Optional[float] = None):
+        import ctypes
+        import win32api
+        import win32con
+        import win32gui
+
+        super().__init__(poll_interval)
+        self._win32gui = win32gui
+        self._updated = False
+
+        wc = win32gui.WNDCLASS()
+        wc.lpfnWndProc = self._wnd_proc
+        wc.lpszClassName = "WaniKaniClipboardListener"
+        wc.hInstance = win32api.GetModuleHandle(None)
+        atom = win32gui.RegisterClass(wc)
+        self._hwnd = win32gui.CreateWindow(
+            atom, wc.lpszClassName, 0, 0, 0, 0, 0,
+            win32con.HWND_MESSAGE, 0, wc.hInstance, None
+        )
+        if not ctypes.windll.user32.AddClipboardFormatListener(self._hwnd):
+            raise OSError("AddClipboardFormatListener failed")
+
+    def _wnd_proc(self, hwnd, msg, wparam, lparam):
+        if msg == self.WM_CLIPBOARDUPDATE:
+            self._updated = True
+            return 0
+        return self._win32gui.DefWindowProc(hwnd, msg, wparam, lparam)
+
+    def listen(self) -> Generator[str, None, None]:
+        win32gui = self._win32gui
+        while True:
+            rc, msg = win32gui.GetMessage(self._hwnd, 0, 0)
+            if rc in (0, -1):
+                return
+            win32gui.TranslateMessage(msg)
+            win32gui.DispatchMessage(msg)
+            if self._updated:
+                self._updated = False
+                current = _paste()
+                if self._changed(current):
+                    yield current
+
+
+class _X11Listener(_PollingListener):
+    """
+    Uses the XFixes extension to block until the CLIPBOARD selection owner
+    changes, then reads the new text.
+    """
+
+    def __init__(self, poll_interval: Optional[float] = None):
+        from Xlib import display as xdisplay
+        from Xlib.ext import xfixes
+
+        super().__init__(poll_interval)
+        self._display = xdisplay.Display()
+        if not self._display.has_extension("XFIXES"):
+            raise RuntimeError("XFIXES extension not available")
+        self._display.xfixes_query_version()
+        root = self._display.screen().root
+        selection = self._display.get_atom("CLIPBOARD")
+        self._display.xfixes_select_selection_input(
+            root, selection, xfixes.XFixesSetSelectionOwnerNotifyMask
+        )
+
+    def listen(self) -> Generator[str, None, None]:
+        notify = self._display.extension_event.SetSelectionOwnerNotify
+        while True:
+            event = self._display.next_event()
+            if (event.type, getattr(event, "sub_code", None)) != notify:
+                continue
+            current = _paste()
+            if self._changed(current):
+                yield current
+
+
+def _backend_for_platform():
+    if sys.platform == "win32":
+        return _Win32Listener
+    if sys.platform == "darwin":
+        return _MacListener
+    if sys.platform.startswith("linux"):
+        return _X11Listener
+    return _PollingListener
+
 
 class ClipboardListener:
     """
-    Simple clipboard listener using polling.
+    Clipboard listener using OS change notifications where available
+    (Win32 WM_CLIPBOARDUPDATE, macOS changeCount, X11 XFixes), falling back
+    to pyperclip polling if the native backend can't be loaded.
     Use: for text in ClipboardListener().listen(): ...
     """
 
-    def __init__(self, poll_interval: float = 0.5):
-        self._poll_interval = poll_interval
+    def __init__(self, poll_interval: Optional[float] = None):
+        backend = _backend_for_platform()
         try:
-            self._last = pyperclip.paste()
+            self._impl = backend(poll_interval)
         except Exception:
-            self._last = None
+            self._impl = _PollingListener(poll_interval)
 
     def listen(self) -> Generator[str, None, None]:
         """Generator yielding new clipboard text when it changes."""
-        while True:
-            try:
-                current = pyperclip.paste()
-            except Exception:
-                current = None
-
-            if current and current != self._last:
-                self._last = current
-                yield current
-            time.sleep(self._poll_interval)
-
+        return self._impl.listen()
@@ -1,7 +1,11 @@
 # image_fetcher.py
 import os
+import atexit
+import shelve
+import threading
 import requests
 import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlencode
 from PIL import Image
 from io import BytesIO
@@ -14,6 +18,32 @@ GOOGLE_CX = os.getenv("GOOGLE_CX")
 MEDIA_DIR = "media"
 os.makedirs(MEDIA_DIR, exist_ok=True)
 
+# Max concurrent candidate downloads
+MAX_FETCHING_THREADS = 5
+
+# Candidates larger than this are abandoned mid-download
+MAX_IMAGE_BYTES = 5_000_000
+
+# Persistent cache: sha1(query) -> (url, filename)
+_QUERY_CACHE = shelve.open(os.path.join(MEDIA_DIR, "image_cache.db"))
+_QUERY_CACHE_LOCK = threading.Lock()
+atexit.register(_QUERY_CACHE.close)
+
+# Formats Anki displays as-is; these are saved verbatim instead of re-encoded
+PASSTHROUGH_EXTS = ("jpg", "png", "webp")
+
+
+def _sniff_image_ext(data: bytes):
+    """Return the file extension for JPEG/PNG/WebP bytes, else None."""
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
 class ImageFetcher:
     """
     Uses Google Custom Search JSON API to fetch image URLs and download the first valid image.
@@ -43,29 +73,96 @@ class ImageFetcher:
         return data.get("items", [])
 
     def _download_image(self, url: str):
+        """
+        Returns (filename, data) without touching disk, so losing candidates leave nothing behind.
+        data is None when the file is already in MEDIA_DIR; (None, None) on failure.
+        """
         try:
-            r = self.session.get(url, timeout=15)
-            r.raise_for_status()
-            img = Image.open(BytesIO(r.content)).convert("RGBA")
             h = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
-            filename = f"img_{h}.png"
-            path = os.path.join(MEDIA_DIR, filename)
-            img.save(path, format="PNG")
-            return path, filename
+            # already downloaded this URL
+            for ext in PASSTHROUGH_EXTS:
+                filename = f"img_{h}.{ext}"
+                if os.path.exists(os.path.join(MEDIA_DIR, filename)):
+                    return filename, None
+
+            # stream so oversized images are rejected before being fully downloaded
+            buf = BytesIO()
+            with self.session.get(url, timeout=15, stream=True) as r:
+                r.raise_for_status()
+                if int(r.headers.get("Content-Length") or 0) > MAX_IMAGE_BYTES:
+                    return None, None
+                for chunk in r.iter_content(65536):
+                    buf.write(chunk)
+                    if buf.tell() > MAX_IMAGE_BYTES:
+                        return None, None
+            data = buf.getvalue()
+
+            # web-friendly formats: keep the original bytes, no decode/re-encode
+            ext = _sniff_image_ext(data[:16])
+            if ext:
+                return f"img_{h}.{ext}", data
+
+            # anything else goes through PIL: JPEG when opaque, WebP to keep transparency
+            buf.seek(0)
+            img = Image.open(buf)
+            out = BytesIO()
+            if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+                filename = f"img_{h}.webp"
+                img.convert("RGBA").save(out, format="WEBP", quality=85, method=6)
+            else:
+                filename = f"img_{h}.jpg"
+                img.convert("RGB").save(out, format="JPEG", quality=82, optimize=True, progressive=True)
+            return filename, out.getvalue()
         except Exception:
             return None, None
 
+    def _save_image(self, filename: str, data: bytes):
+        # write to a temp name and move into place, so an interrupted write never leaves a
+        # truncated image that the URL cache would reuse
+        path = os.path.join(MEDIA_DIR, filename)
+        partpath = path + ".part"
+        try:
+            with open(partpath, "wb") as f:
+                f.write(data)
+            os.replace(partpath, path)
+        except Exception:
+            try:
+                os.remove(partpath)
+            except OSError:
+                pass
+            raise
+
     def search_and_download(self, query: str, seed_sentence: str = None):
+        key = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        with _QUERY_CACHE_LOCK:
+            cached = _QUERY_CACHE.get(key)
+        if cached and os.path.exists(os.path.join(MEDIA_DIR, cached[1])):
+            return cached
+
         try:
             items = self._search_images(query, num=5)
-            for it in items:
-                link = it.get("link")
-                if not link:
-                    continue
-                path, filename = self._download_image(link)
-                if path and filename:
-                    return link, filename
-            return None, None
+            links = [it["link"] for it in items if it.get("link")]
+            if not links:
+                return None, None
+
+            # download all candidates concurrently; first valid image wins
+            ex = ThreadPoolExecutor(max_workers=min(MAX_FETCHING_THREADS, len(links)))
+            try:
+                futs = {ex.submit(self._download_image, link): link for link in links}
+                for fut in as_completed(futs):
+                    filename, data = fut.result()
+                    if filename:
+                        # only the winner is written to disk
+                        if data is not None:
+                            self._save_image(filename, data)
+                        with _QUERY_CACHE_LOCK:
+                            _QUERY_CACHE[key] = (futs[fut], filename)
+                            _QUERY_CACHE.sync()
+                        return futs[fut], filename
+                return None, None
+            finally:
+                # don't wait for slower candidates once we have a winner
+                ex.shutdown(wait=False, cancel_futures=True)
         except Exception as e:
             print("[ImageFetcher] error:", e)
             return None, None